@@ -1,9 +1,11 @@
 from typing import Union
-from telethon import TelegramClient, types, errors, custom
+from telethon import TelegramClient, types, errors, custom, events, functions
 from telegram_to_rss.consts import TELEGRAM_NOTIFICATIONS_DIALOG_ID
-from telethon.utils import resolve_id
+from telegram_to_rss.dialog_rules import DialogRules
+from telethon.utils import get_peer_id, resolve_id
 from telegram_to_rss.consts import MESSAGE_FETCH_HARD_LIMIT
 import logging
+import time
 
 
 class TelegramToRssClient:
@@ -11,15 +13,37 @@ class TelegramToRssClient:
     _qr_code_url: str | None = None
     _user: types.User = None
     _password: str | None = None
+    _dialog_rules: DialogRules
+    _dialog_refresh_interval: float
+    _dialogs: list[custom.Dialog] | None = None
+    _dialogs_refreshed_at: float = 0
+    _dialogs_stale: bool = False
+    _is_refreshing_dialogs: bool = False
+    # Every dialog the cached list was decided on, included or not
+    _dialog_ids: set[int]
+    _dialog_filters: list[types.TypeDialogFilter]
 
     def __init__(
-        self, session_path: str, api_id: int, api_hash: str, password: str | None = None
+        self,
+        session_path: str,
+        api_id: int,
+        api_hash: str,
+        password: str | None = None,
+        dialog_rules: DialogRules | None = None,
+        dialog_refresh_interval: float = 0,
     ):
         self._telethon = TelegramClient(
             session=session_path, api_id=api_id, api_hash=api_hash
         )
         self._telethon.parse_mode = "html"
         self._password = password
+        self._dialog_rules = dialog_rules or DialogRules()
+        self._dialog_refresh_interval = dialog_refresh_interval
+        self._dialog_ids = set()
+        self._dialog_filters = []
+
+        self._telethon.add_event_handler(self._on_new_message, events.NewMessage())
+        self._telethon.add_event_handler(self._on_chat_action, events.ChatAction())
 
     async def start(self):
         await self._telethon.connect()
@@ -44,17 +68,149 @@ class TelegramToRssClient:
         if self._telethon.is_connected():
             await self._telethon.disconnect()
 
-    async def list_dialogs(self) -> list[custom.Dialog]:
-        all_dialogs = await self._telethon.get_dialogs()
-        filtered_dialogs = [
-            dialog
-            for dialog in all_dialogs
-            if (
-                dialog.id != TELEGRAM_NOTIFICATIONS_DIALOG_ID
-                and dialog.entity.id != self._user.id
+    def invalidate_dialogs(self):
+        self._dialogs = None
+
+    def _accept_dialogs(self, dialogs: list[custom.Dialog]) -> list[custom.Dialog]:
+        return self._dialog_rules.filter_dialogs(
+            [
+                dialog
+                for dialog in dialogs
+                if (
+                    dialog.id != TELEGRAM_NOTIFICATIONS_DIALOG_ID
+                    and dialog.entity.id != self._user.id
+                )
+            ],
+            self._dialog_filters,
+        )
+
+    async def _add_dialog(
+        self, event: Union[events.NewMessage.Event, events.ChatAction.Event]
+    ):
+        chat_id = event.chat_id
+        if self._dialogs is None or self._dialogs_stale or chat_id in self._dialog_ids:
+            return
+        # Other updates from this chat must not fetch it again meanwhile
+        self._dialog_ids.add(chat_id)
+
+        try:
+            res = await self._telethon(
+                functions.messages.GetPeerDialogsRequest(
+                    peers=[types.InputDialogPeer(await event.get_input_chat())]
+                )
             )
-        ]
-        return filtered_dialogs
+            entities = {
+                get_peer_id(entity): entity for entity in res.users + res.chats
+            }
+            dialogs = [
+                custom.Dialog(self._telethon, dialog, entities, None)
+                for dialog in res.dialogs
+                if isinstance(dialog, types.Dialog)
+            ]
+        except Exception as e:
+            logging.warning(
+                "TelegramToRssClient._add_dialog -> cannot get %s: %s", chat_id, e
+            )
+            self._dialog_ids.discard(chat_id)
+            self._dialogs_stale = True
+            return
+
+        # Archived chats are not fetched when they are excluded anyway
+        if not self._dialog_rules.needs_archived:
+            dialogs = [dialog for dialog in dialogs if not dialog.archived]
+        accepted_dialogs = self._accept_dialogs(dialogs)
+        logging.debug(
+            "TelegramToRssClient._add_dialog %s -> %s",
+            chat_id,
+            [dialog.name for dialog in accepted_dialogs],
+        )
+        self._dialogs.extend(accepted_dialogs)
+        self._on_dialogs_changed()
+
+    def _remove_dialog(self, chat_id: int):
+        if self._dialogs is None:
+            return
+        logging.debug("TelegramToRssClient._remove_dialog %s", chat_id)
+        self._dialog_ids.discard(chat_id)
+        self._dialogs = [dialog for dialog in self._dialogs if dialog.id != chat_id]
+        self._on_dialogs_changed()
+
+    def _rename_dialog(self, chat_id: int, name: str):
+        if self._dialogs is None:
+            return
+        for dialog in self._dialogs:
+            if dialog.id == chat_id:
+                logging.debug("TelegramToRssClient._rename_dialog %s %s", chat_id, name)
+                dialog.name = dialog.title = name
+        self._on_dialogs_changed()
+
+    def _on_dialogs_changed(self):
+        # The list being fetched right now may predate this change
+        if self._is_refreshing_dialogs:
+            self._dialogs_stale = True
+
+    async def _on_new_message(self, event: events.NewMessage.Event):
+        # A message from a chat we have not seen yet means a new dialog
+        await self._add_dialog(event)
+
+    async def _on_chat_action(self, event: events.ChatAction.Event):
+        # Other members joining or leaving does not change our dialog list
+        is_about_us = self._user is not None and self._user.id in (
+            event.user_ids or []
+        )
+        if event.created or ((event.user_joined or event.user_added) and is_about_us):
+            await self._add_dialog(event)
+        elif (event.user_left or event.user_kicked) and is_about_us:
+            self._remove_dialog(event.chat_id)
+        elif event.new_title:
+            self._rename_dialog(event.chat_id, event.new_title)
+
+    async def _refresh_dialogs(self):
+        logging.debug("TelegramToRssClient._refresh_dialogs")
+
+        # Cleared before fetching, so updates arriving meanwhile are not lost
+        self._dialogs_stale = False
+        self._is_refreshing_dialogs = True
+        try:
+            archived = None if self._dialog_rules.needs_archived else False
+            all_dialogs = await self._telethon.get_dialogs(archived=archived)
+
+            dialog_filters = []
+            if self._dialog_rules.uses_folders:
+                res = await self._telethon(functions.messages.GetDialogFiltersRequest())
+                dialog_filters = getattr(res, "filters", res)
+        except BaseException:
+            self._dialogs_stale = True
+            raise
+        finally:
+            self._is_refreshing_dialogs = False
+
+        self._dialog_filters = dialog_filters
+        self._dialog_ids = set(dialog.id for dialog in all_dialogs)
+        self._dialogs = self._accept_dialogs(all_dialogs)
+        self._dialogs_refreshed_at = time.monotonic()
+
+        logging.debug(
+            "TelegramToRssClient._refresh_dialogs -> %s out of %s dialogs",
+            len(self._dialogs),
+            len(all_dialogs),
+        )
+
+    async def list_dialogs(self) -> list[custom.Dialog]:
+        """Returns the dialogs allowed by the dialog rules.
+
+        The list is cached and kept up to date from update events. It is only
+        fetched again once every dialog_refresh_interval seconds, after a
+        reconnect, or when an update could not be applied.
+        """
+        if (
+            self._dialogs is None
+            or self._dialogs_stale
+            or time.monotonic() - self._dialogs_refreshed_at
+            >= self._dialog_refresh_interval
+        ):
+            await self._refresh_dialogs()
+        return self._dialogs
 
     async def get_dialog_messages(
         self,
@@ -2,6 +2,11 @@ import os
 from pathlib import Path
 from platformdirs import user_data_dir
 
+
+def env_list(name: str) -> list[str]:
+    return [item.strip() for item in (os.environ.get(name) or "").split(",") if item.strip()]
+
+
 api_id = int(os.environ.get("TG_API_ID"))
 api_hash = os.environ.get("TG_API_HASH")
 password = os.environ.get("TG_PASSWORD")
@@ -13,6 +18,28 @@ base_url = os.environ.get("BASE_URL")
 bind = os.environ.get("BIND") or "127.0.0.1:3042"
 max_media_size_mb = int(os.environ.get("MAX_MEDIA_SIZE_MB", 10))
 max_media_size = max_media_size_mb * 1024 * 1024
+# 0 disables the limit
+max_media_storage_mb = int(os.environ.get("MAX_MEDIA_STORAGE_MB", 0))
+max_media_storage = max_media_storage_mb * 1024 * 1024
+
+# Enables /debug/profile for requests that send it as a bearer token
+debug_token = os.environ.get("DEBUG_TOKEN")
+# 0 disables cycle profiling
+profile_every_n_cycles = int(os.environ.get("PROFILE_EVERY_N_CYCLES") or 0)
+
+dialog_types = set(env_list("DIALOG_TYPES") or ["channel", "group", "user"])
+include_archived = (os.environ.get("INCLUDE_ARCHIVED") or "true").lower() == "true"
+include_folders = set(env_list("INCLUDE_FOLDERS"))
+exclude_folders = set(env_list("EXCLUDE_FOLDERS"))
+include_dialog_ids = set(int(id) for id in env_list("INCLUDE_DIALOG_IDS"))
+exclude_dialog_ids = set(int(id) for id in env_list("EXCLUDE_DIALOG_IDS"))
+dialog_refresh_interval_seconds = int(os.environ.get("DIALOG_REFRESH_INTERVAL") or 21600)
+# 0 disables the WebSub hub
+websub_workers = int(os.environ.get("WEBSUB_WORKERS") or 0)
+# Subscriber callbacks on loopback or private networks are refused by default
+websub_allow_private_callbacks = (
+    os.environ.get("WEBSUB_ALLOW_PRIVATE_CALLBACKS") or "false"
+).lower() == "true"
 
 loglevel = os.environ.get("LOGLEVEL", "INFO").upper()
 
@@ -23,7 +50,11 @@ data_dir = (
 )
 session_path = data_dir.joinpath("telegram_to-rss.session")
 static_path = data_dir.joinpath("static")
+# Outside of static_path so that unfinished downloads are never served
+partial_path = data_dir.joinpath("partial")
 db_path = data_dir.joinpath("feeds.db")
+profile_path = data_dir.joinpath("profiles")
 
 data_dir.mkdir(mode=0o700, parents=True, exist_ok=True)
 static_path.mkdir(mode=0o700, exist_ok=True)
+partial_path.mkdir(mode=0o700, exist_ok=True)
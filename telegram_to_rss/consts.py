@@ -1,2 +1,14 @@
 TELEGRAM_NOTIFICATIONS_DIALOG_ID = 777000
 MESSAGE_FETCH_HARD_LIMIT = 1000
+# Multiple of 4096 dividing 1 MiB, as required by upload.getFile
+DOWNLOAD_CHUNK_SIZE = 512 * 1024
+DOWNLOAD_RETRIES = 3
+PARTIAL_DOWNLOAD_MAX_AGE_SECONDS = 7 * 24 * 3600
+WEBSUB_DEFAULT_LEASE_SECONDS = 10 * 24 * 3600
+WEBSUB_MAX_LEASE_SECONDS = 30 * 24 * 3600
+WEBSUB_MAX_ATTEMPTS = 6
+WEBSUB_RETRY_DELAY_SECONDS = 60
+WEBSUB_DISPATCH_INTERVAL_SECONDS = 30
+WEBSUB_HTTP_TIMEOUT_SECONDS = 20
+# Cycles an interrupted download may abort before it is marked as failed
+DOWNLOAD_MAX_INTERRUPTIONS = 5
@@ -1,5 +1,30 @@
 from tortoise import Tortoise
 
+# generate_schemas(safe=True) only creates missing tables, so columns added to
+# existing models after the first release are appended to old databases here.
+ADDED_COLUMNS = [
+    ("feedentry", "title", "TEXT"),
+    ("feedentry", "link", "TEXT"),
+    ("feedentry", "description", "TEXT"),
+    ("feedentry", "render_version", "TEXT"),
+    ("websubsubscription", "published_digest", "TEXT"),
+]
+
+
+async def add_missing_columns():
+    connection = Tortoise.get_connection("default")
+    existing_columns: dict[str, set[str]] = {}
+
+    for table, column, column_type in ADDED_COLUMNS:
+        if table not in existing_columns:
+            rows = await connection.execute_query_dict(f'PRAGMA table_info("{table}")')
+            existing_columns[table] = set(row["name"] for row in rows)
+        if column not in existing_columns[table]:
+            await connection.execute_script(
+                f'ALTER TABLE "{table}" ADD COLUMN "{column}" {column_type}'
+            )
+            existing_columns[table].add(column)
+
 
 async def init_feeds_db(db_path: str):
     await Tortoise.init(
@@ -8,6 +33,7 @@ async def init_feeds_db(db_path: str):
     )
     # Generate the schema
     await Tortoise.generate_schemas(safe=True)
+    await add_missing_columns()
 
 
 async def close_feeds_db():
@@ -0,0 +1,120 @@
+import logging
+from telethon import custom, types
+from telethon.utils import get_peer_id
+
+DIALOG_TYPES = frozenset({"channel", "group", "user"})
+
+
+def get_dialog_type(dialog: custom.Dialog):
+    if dialog.is_user:
+        return "user"
+    if dialog.is_group:
+        return "group"
+    return "channel"
+
+
+def _get_peer_ids(peers: list[types.TypeInputPeer]) -> set[int]:
+    peer_ids: set[int] = set()
+    for peer in peers:
+        # Saved Messages never becomes a feed
+        if isinstance(peer, types.InputPeerSelf):
+            continue
+        try:
+            peer_ids.add(get_peer_id(peer))
+        except TypeError as e:
+            logging.warning(f"Skipping folder peer {peer}: {e}")
+    return peer_ids
+
+
+def get_folder_peer_ids(dialog_filter: types.TypeDialogFilter) -> set[int]:
+    # Only the chats added to a folder by hand are resolved, folders defined
+    # by flags ("all groups", "non-contacts", ...) have to be listed by id.
+    peer_ids = _get_peer_ids(
+        getattr(dialog_filter, "pinned_peers", [])
+        + getattr(dialog_filter, "include_peers", [])
+    )
+    peer_ids -= _get_peer_ids(getattr(dialog_filter, "exclude_peers", []))
+    return peer_ids
+
+
+class DialogRules:
+    """Decides which dialogs become feeds.
+
+    Excluded ids and folders always win. If any include rule is set, only the
+    dialogs listed in INCLUDE_DIALOG_IDS or in one of INCLUDE_FOLDERS are kept.
+    The type and archive rules apply to everything not listed by id.
+    """
+
+    dialog_types: set[str]
+    include_archived: bool
+    include_folders: set[str]
+    exclude_folders: set[str]
+    include_ids: set[int]
+    exclude_ids: set[int]
+
+    def __init__(
+        self,
+        dialog_types: set[str] | None = None,
+        include_archived: bool = True,
+        include_folders: set[str] | None = None,
+        exclude_folders: set[str] | None = None,
+        include_ids: set[int] | None = None,
+        exclude_ids: set[int] | None = None,
+    ) -> None:
+        dialog_types = set(DIALOG_TYPES) if dialog_types is None else dialog_types
+        unknown_dialog_types = dialog_types - DIALOG_TYPES
+        if len(unknown_dialog_types) != 0:
+            raise Exception(
+                "Unknown dialog types {}, supported: {}".format(
+                    ", ".join(unknown_dialog_types), ", ".join(DIALOG_TYPES)
+                )
+            )
+
+        self.dialog_types = dialog_types
+        self.include_archived = include_archived
+        self.include_folders = include_folders or set()
+        self.exclude_folders = exclude_folders or set()
+        self.include_ids = include_ids or set()
+        self.exclude_ids = exclude_ids or set()
+
+    @property
+    def uses_folders(self):
+        return len(self.include_folders) != 0 or len(self.exclude_folders) != 0
+
+    @property
+    def needs_archived(self):
+        return self.include_archived or len(self.include_ids) != 0
+
+    def folder_peer_ids(
+        self, dialog_filters: list[types.TypeDialogFilter], folders: set[str]
+    ) -> set[int]:
+        peer_ids: set[int] = set()
+        for dialog_filter in dialog_filters:
+            title = getattr(dialog_filter, "title", None)
+            if not isinstance(title, str) and title is not None:
+                title = title.text
+            if str(getattr(dialog_filter, "id", None)) in folders or title in folders:
+                peer_ids |= get_folder_peer_ids(dialog_filter)
+        return peer_ids
+
+    def filter_dialogs(
+        self,
+        dialogs: list[custom.Dialog],
+        dialog_filters: list[types.TypeDialogFilter],
+    ) -> list[custom.Dialog]:
+        included_folder_ids = self.folder_peer_ids(dialog_filters, self.include_folders)
+        excluded_folder_ids = self.folder_peer_ids(dialog_filters, self.exclude_folders)
+        has_include_rules = len(self.include_ids) != 0 or len(self.include_folders) != 0
+
+        def is_included(dialog: custom.Dialog):
+            if dialog.id in self.exclude_ids or dialog.id in excluded_folder_ids:
+                return False
+            if dialog.id in self.include_ids:
+                return True
+            if has_include_rules and dialog.id not in included_folder_ids:
+                return False
+            if not self.include_archived and dialog.archived:
+                return False
+            return get_dialog_type(dialog) in self.dialog_types
+
+        return [dialog for dialog in dialogs if is_included(dialog)]
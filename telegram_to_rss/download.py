@@ -0,0 +1,172 @@
+import asyncio
+import json
+import logging
+import os
+from pathlib import Path
+
+from telethon import TelegramClient, types
+from telethon.tl.custom import Message
+
+from telegram_to_rss.consts import (
+    DOWNLOAD_CHUNK_SIZE,
+    DOWNLOAD_MAX_INTERRUPTIONS,
+    DOWNLOAD_RETRIES,
+)
+
+
+# Errors after which a download is resumed instead of marked as failed
+DOWNLOAD_INTERRUPTED_ERRORS = (ConnectionError, TimeoutError)
+
+
+class DownloadProgress:
+    """Progress of a partial download, kept next to it in a JSON file so it
+    survives restarts."""
+
+    _progress_path: Path
+    media_id: int
+    size: int | None
+    interruptions: int
+    is_resumed: bool
+
+    def __init__(self, progress_path: Path, media_id: int, size: int | None) -> None:
+        self._progress_path = progress_path
+        self.media_id = media_id
+        self.size = size
+        self.interruptions = 0
+        self.is_resumed = False
+
+        try:
+            progress = json.loads(progress_path.read_text())
+        except (FileNotFoundError, ValueError):
+            return
+        if progress.get("media_id") == media_id and progress.get("size") == size:
+            self.interruptions = progress.get("interruptions", 0)
+            self.is_resumed = True
+
+    def save(self):
+        self._progress_path.write_text(
+            json.dumps(
+                {
+                    "media_id": self.media_id,
+                    "size": self.size,
+                    "interruptions": self.interruptions,
+                }
+            )
+        )
+
+    def interrupted(self):
+        self.interruptions += 1
+        self.save()
+
+    def check_interruptions(self, *partial_files: Path):
+        if self.interruptions < DOWNLOAD_MAX_INTERRUPTIONS:
+            return
+        for partial_file in partial_files:
+            partial_file.unlink(missing_ok=True)
+        self._progress_path.unlink(missing_ok=True)
+        raise Exception(f"download interrupted {self.interruptions} times, giving up")
+
+    def done(self):
+        self._progress_path.unlink(missing_ok=True)
+
+
+async def download_document(
+    client: TelegramClient,
+    document: types.Document,
+    media_path: Path,
+    partial_path: Path,
+    chunk_size: int = DOWNLOAD_CHUNK_SIZE,
+    retries: int = DOWNLOAD_RETRIES,
+):
+    """Downloads a document chunk by chunk into partial_path and moves it to
+    media_path once complete.
+
+    An interrupted download resumes from the last complete chunk, both when
+    retried here and when called again after a reconnect or a restart.
+    Connection errors are raised once the retries are used up, the partial
+    file is kept for the next attempt. After DOWNLOAD_MAX_INTERRUPTIONS
+    such attempts the download fails for good.
+    """
+    part_path = partial_path.joinpath(media_path.name + ".part")
+    progress = DownloadProgress(
+        partial_path.joinpath(media_path.name + ".part.json"), document.id, document.size
+    )
+
+    # Finished before an interruption later in the same batch rolled it back
+    if media_path.is_file() and media_path.stat().st_size == document.size:
+        progress.done()
+        return
+
+    progress.check_interruptions(part_path)
+
+    offset = 0
+    if progress.is_resumed and part_path.is_file():
+        # A chunk may have been written only partially before a crash
+        offset = min(part_path.stat().st_size, document.size) // chunk_size * chunk_size
+        logging.info(
+            "Resuming download of %s at %s out of %s", media_path.name, offset, document.size
+        )
+    else:
+        progress.save()
+
+    attempt = 0
+    with part_path.open("r+b" if offset else "wb") as part_file:
+        part_file.truncate(offset)
+        part_file.seek(offset)
+
+        while offset < document.size:
+            try:
+                async for chunk in client.iter_download(
+                    document,
+                    offset=offset,
+                    request_size=chunk_size,
+                    file_size=document.size,
+                ):
+                    part_file.write(chunk)
+                    offset += len(chunk)
+                    logging.debug(
+                        "Downloading %s: %s out of %s", media_path.name, offset, document.size
+                    )
+                break
+            except DOWNLOAD_INTERRUPTED_ERRORS as e:
+                part_file.flush()
+                attempt += 1
+                if attempt > retries:
+                    progress.interrupted()
+                    raise
+                logging.warning(
+                    f"Downloading {media_path.name} interrupted at {offset} with {e}, retrying"
+                )
+                await asyncio.sleep(attempt)
+
+    if offset < document.size:
+        raise Exception(f"download stopped at {offset} out of {document.size}")
+
+    os.replace(part_path, media_path)
+    progress.done()
+
+
+async def download_photo(dialog_message: Message, media_path: Path, partial_path: Path):
+    # Photos are small enough to be fetched in one go, they only go through
+    # partial_path so that a half written file is never served
+    part_path = partial_path.joinpath(media_path.name + ".part")
+    progress = DownloadProgress(
+        partial_path.joinpath(media_path.name + ".part.json"),
+        dialog_message.photo.id,
+        None,
+    )
+    if media_path.is_file():
+        progress.done()
+        return
+    progress.check_interruptions(part_path)
+
+    try:
+        data = await dialog_message.download_media(file=bytes)
+    except DOWNLOAD_INTERRUPTED_ERRORS:
+        progress.interrupted()
+        raise
+    if data is None:
+        raise Exception("Telegram returned no data")
+    part_path.write_bytes(data)
+    os.replace(part_path, media_path)
+    progress.done()
@@ -1,35 +1,68 @@
+import hashlib
 import logging
-import mimetypes
-import re
 import xml.etree.ElementTree as ET
 from pathlib import Path
 
 from tortoise.query_utils import Prefetch
 
-from telegram_to_rss.config import base_url
 from telegram_to_rss.models import Feed, FeedEntry
 from telegram_to_rss.poll_telegram import TelegramPoller, parse_feed_entry_id
+from telegram_to_rss.profiling import profile_stage
+from telegram_to_rss.render import (
+    RENDERED_FIELDS,
+    current_render_version,
+    render_feed_entry,
+    to_telegram_url,
+)
+from telegram_to_rss.websub import WebSubHub
+
+ATOM_NAMESPACE = "http://www.w3.org/2005/Atom"
+ET.register_namespace("atom", ATOM_NAMESPACE)
+
+
+async def rerender_stale_entries(
+    feed: Feed, tg_id_or_username: str | int
+) -> list[FeedEntry]:
+    render_version = current_render_version()
+    # Links embed the username resolved at render time, which can change
+    link_prefix = to_telegram_url(tg_id_or_username) + "/"
+    stale_entries = [
+        feed_entry
+        for feed_entry in feed.entries
+        if feed_entry.render_version != render_version
+        or not (feed_entry.link or "").startswith(link_prefix)
+    ]
+    if len(stale_entries) == 0:
+        return stale_entries
+
+    logging.info(
+        "rerender_stale_entries %s %s -> %s entries",
+        feed.name,
+        feed.id,
+        len(stale_entries),
+    )
+    for feed_entry in stale_entries:
+        [_, entry_id] = parse_feed_entry_id(feed_entry.id)
+        render_feed_entry(feed_entry, to_telegram_url(tg_id_or_username, entry_id))
 
-CLEAN_TITLE = re.compile("<.*?>")
-
-
-def clean_title(raw_html):
-    cleantext = re.sub(CLEAN_TITLE, "", raw_html).replace("\n", " ").strip()
-    return cleantext
+    await FeedEntry.bulk_update(stale_entries, fields=RENDERED_FIELDS)
+    return stale_entries
 
 
 async def generate_feed(
-    telegram_poller: TelegramPoller, feed_render_dir: Path, feed: Feed
+    telegram_poller: TelegramPoller,
+    feed_render_dir: Path,
+    feed: Feed,
+    websub_hub: WebSubHub | None = None,
 ):
     logging.info("generate_feed %s %s", feed.name, feed.id)
 
     feed_id = await telegram_poller._client.telethon_dialog_id_to_tg_id_or_username(
         feed.id
     )
-    if isinstance(feed_id, int):
-        feed_url = f"https://t.me/c/{feed_id}"
-    else:
-        feed_url = f"https://t.me/{feed_id}"
+    feed_url = to_telegram_url(feed_id)
+
+    await rerender_stale_entries(feed, feed_id)
 
     rss_root_el = ET.Element("rss", {"version": "2.0"})
 
@@ -43,77 +76,33 @@ async def generate_feed(
         {"href": feed_url},
     )
     ET.SubElement(rss_feed_el, "description").text = feed.name
+    if websub_hub is not None:
+        ET.SubElement(
+            rss_feed_el,
+            "{{{}}}link".format(ATOM_NAMESPACE),
+            {"rel": "hub", "href": websub_hub.hub_url},
+        )
+        ET.SubElement(
+            rss_feed_el,
+            "{{{}}}link".format(ATOM_NAMESPACE),
+            {"rel": "self", "href": websub_hub.topic_url(feed.id)},
+        )
 
+    # pubDate of the channel changes on every update, subscribers are only
+    # notified when the items do
+    items_digest = hashlib.sha256()
     for feed_entry in feed.entries:
-        [feed_id, entry_id] = parse_feed_entry_id(feed_entry.id)
-        feed_id_ = (
-            await telegram_poller._client.telethon_dialog_id_to_tg_id_or_username(
-                feed_id
-            )
-        )
-        if isinstance(feed_id_, int):
-            feed_entry_url = f"https://t.me/c/{feed_id_}/{entry_id}"
-        else:
-            feed_entry_url = f"https://t.me/{feed_id_}/{entry_id}"
+        items_digest.update(feed_entry.link.encode())
+        items_digest.update(feed_entry.description.encode())
 
         rss_item_el = ET.SubElement(rss_feed_el, "item")
 
-        ET.SubElement(rss_item_el, "guid").text = feed_entry_url
-
-        message_text = clean_title(feed_entry.message)
-        title = message_text[:100]
-        ET.SubElement(rss_item_el, "title").text = title
-
-        media_content = ""
-        media_download_failure = 0
-        media_too_large = 0
-
-        # processing mediafiles
-        for media_path in feed_entry.media:
-            if media_path == "FAIL":
-                media_download_failure += 1
-            elif media_path == "TOO_LARGE":
-                media_too_large += 1
-            else:
-                media_url = "{}/static/{}".format(base_url, media_path)
-
-                # checking file type
-                mime = mimetypes.guess_type(media_url)[0] or ""
-                mtype = mime.split("/")[0]
-                if mtype == "image":
-                    media_content += '<br /><img src="{}" alt="media"/>'.format(
-                        media_url
-                    )
-                elif mtype == "video":
-                    media_content += (
-                        '<br /><video controls poster="{}" style="max-width:100%;">'
-                        '<source src="{}" type="{}">'
-                        "Your browser does not support the video tag.</video>"
-                    ).format(media_url, media_url, mime)
-                elif mtype == "audio":
-                    media_content += '<br /><audio controls><source src="{}" type="{}"></audio>'.format(
-                        media_url, mime
-                    )
-                else:
-                    media_content += (
-                        '<br /><a href="{}">{}</a>'.format(
-                            media_url, media_path
-                        )
-                    )
-
-        # creating feed with text and media
-        content = feed_entry.message.replace("\n", "<br />") + media_content
-        if feed_entry.has_unsupported_media:
-            content += "<br /><strong>This message has unsupported attachment. Open Telegram to view it.</strong>"
-        if media_download_failure > 0:
-            content += f"<br /><strong>{media_download_failure} attachment(s) of this message has failed to download. Open Telegram to view it.</strong>"
-        if media_too_large:
-            content += f"<br /><strong>{media_too_large} attachment(s) of this message is too large to download. Open Telegram to view it.</strong>"
-
-        ET.SubElement(rss_item_el, "description").text = content
+        ET.SubElement(rss_item_el, "guid").text = feed_entry.link
+        ET.SubElement(rss_item_el, "title").text = feed_entry.title
+        ET.SubElement(rss_item_el, "description").text = feed_entry.description
         ET.SubElement(rss_item_el, "pubDate").text = feed_entry.date.isoformat()
-        ET.SubElement(rss_item_el, "link", {"href": feed_entry_url}).text = (
-            feed_entry_url
+        ET.SubElement(rss_item_el, "link", {"href": feed_entry.link}).text = (
+            feed_entry.link
         )
 
     final_feed_file = feed_render_dir.joinpath("{}.xml".format(feed.id))
@@ -123,13 +112,25 @@ async def generate_feed(
         file_or_filename=final_feed_file, encoding="UTF-8", short_empty_elements=True
     )
 
+    if websub_hub is not None:
+        try:
+            await websub_hub.publish(feed.id, items_digest.hexdigest())
+        except Exception as e:
+            # The feed is written, subscribers get the next change instead
+            logging.error(f"generate_feed -> publish error: {e}", exc_info=True)
+
     logging.info("generate_feed -> done %s %s", feed.name, feed.id)
 
 
-async def update_feeds_cache(telegram_poller: TelegramPoller, feed_render_dir: str):
+async def update_feeds_cache(
+    telegram_poller: TelegramPoller,
+    feed_render_dir: str,
+    websub_hub: WebSubHub | None = None,
+):
     feeds = await Feed.all().prefetch_related(
         Prefetch("entries", queryset=FeedEntry.all().order_by("-date"))
     )
 
     for feed in feeds:
-        await generate_feed(telegram_poller, feed_render_dir, feed)
+        async with profile_stage("generate_feed", feed.id):
+            await generate_feed(telegram_poller, feed_render_dir, feed, websub_hub)
@@ -0,0 +1,188 @@
+from datetime import datetime, timezone
+from pathlib import Path
+from telegram_to_rss.consts import PARTIAL_DOWNLOAD_MAX_AGE_SECONDS
+from tortoise.functions import Sum
+from tortoise.transactions import in_transaction
+from telegram_to_rss.models import FeedEntry, MediaFile
+import logging
+import time
+
+MEDIA_PLACEHOLDERS = {"FAIL", "TOO_LARGE", "EVICTED"}
+
+
+def is_media_file_name(name: str):
+    # Media files are named "<feed id>--<message id>-<n><ext>" by
+    # TelegramPoller._download_media, rendered feeds are "<feed id>.xml"
+    return "--" in name
+
+
+class MediaStorage:
+    """Keeps the downloaded media under static_path within a byte budget.
+
+    Sizes and last access times live in MediaFile rows. When the total size
+    goes over the budget, the least recently served files are removed and
+    their feed entries point readers to Telegram instead.
+    """
+
+    _static_path: Path
+    _partial_path: Path
+    _max_size: int
+    _accessed: dict[str, datetime]
+
+    def __init__(self, static_path: Path, partial_path: Path, max_size: int) -> None:
+        self._static_path = static_path
+        self._partial_path = partial_path
+        self._max_size = max_size
+        self._accessed = {}
+
+    def touch(self, name: str):
+        if is_media_file_name(name):
+            self._accessed[name] = datetime.now(timezone.utc)
+
+    async def register(self, feed_entries: list[FeedEntry]):
+        now = datetime.now(timezone.utc)
+        media_files: list[MediaFile] = []
+
+        for feed_entry in feed_entries:
+            for media_path in feed_entry.media:
+                if media_path in MEDIA_PLACEHOLDERS:
+                    continue
+                try:
+                    size = self._static_path.joinpath(media_path).stat().st_size
+                except FileNotFoundError:
+                    logging.warning(
+                        f"MediaStorage.register -> {media_path} of {feed_entry.id} is missing"
+                    )
+                    continue
+                media_files.append(
+                    MediaFile(
+                        path=media_path,
+                        feed_entry_id=feed_entry.id,
+                        size=size,
+                        last_access=now,
+                    )
+                )
+
+        if len(media_files) != 0:
+            await MediaFile.bulk_create(media_files, ignore_conflicts=True)
+
+    async def flush_access_times(self):
+        if len(self._accessed) == 0:
+            return
+
+        accessed = self._accessed
+        self._accessed = {}
+
+        # bulk_update needs an "id" primary key, MediaFile is keyed by path
+        async with in_transaction():
+            for path, last_access in accessed.items():
+                await MediaFile.filter(path=path).update(last_access=last_access)
+
+    async def total_size(self) -> int:
+        res = await MediaFile.all().annotate(total=Sum("size")).first().values("total")
+        return (res or {}).get("total") or 0
+
+    async def enforce_budget(self):
+        if self._max_size <= 0:
+            return
+
+        total_size = await self.total_size()
+        logging.debug(
+            "MediaStorage.enforce_budget %s out of %s bytes", total_size, self._max_size
+        )
+        if total_size <= self._max_size:
+            return
+
+        evicted: dict[str, list[str]] = {}
+        evicted_count = 0
+        for media_file in await MediaFile.all().order_by("last_access", "created"):
+            if total_size <= self._max_size:
+                break
+            self._static_path.joinpath(media_file.path).unlink(missing_ok=True)
+            total_size -= media_file.size
+            evicted_count += 1
+            evicted.setdefault(media_file.feed_entry_id, []).append(media_file.path)
+
+        await MediaFile.filter(
+            path__in=[path for paths in evicted.values() for path in paths]
+        ).delete()
+
+        feed_entries = await FeedEntry.filter(id__in=list(evicted.keys()))
+        for feed_entry in feed_entries:
+            evicted_paths = evicted[feed_entry.id]
+            feed_entry.media = [
+                "EVICTED" if media_path in evicted_paths else media_path
+                for media_path in feed_entry.media
+            ]
+            # Picked up by generate_feed, which re-renders stale entries
+            feed_entry.render_version = None
+        if len(feed_entries) != 0:
+            await FeedEntry.bulk_update(
+                feed_entries, fields=["media", "render_version"]
+            )
+
+        logging.info(
+            "MediaStorage.enforce_budget -> evicted %s files, %s bytes left",
+            evicted_count,
+            total_size,
+        )
+
+    async def reconcile(self):
+        """Removes media files no feed entry references and partial downloads
+        nobody resumed for a while, and backfills MediaFile rows for referenced
+        files that are not tracked yet."""
+        stale_before = time.time() - PARTIAL_DOWNLOAD_MAX_AGE_SECONDS
+        for file_path in self._partial_path.iterdir():
+            if file_path.is_file() and file_path.stat().st_mtime < stale_before:
+                logging.info(
+                    f"MediaStorage.reconcile -> removing stale partial {file_path.name}"
+                )
+                file_path.unlink(missing_ok=True)
+
+        referenced: dict[str, str] = {}
+        for feed_entry_id, media in await FeedEntry.all().values_list("id", "media"):
+            for media_path in media:
+                if media_path not in MEDIA_PLACEHOLDERS:
+                    referenced[media_path] = feed_entry_id
+
+        tracked = set(await MediaFile.all().values_list("path", flat=True))
+
+        on_disk: set[str] = set()
+        for file_path in self._static_path.iterdir():
+            if not file_path.is_file() or not is_media_file_name(file_path.name):
+                continue
+            if file_path.name in referenced:
+                on_disk.add(file_path.name)
+                continue
+            logging.info(f"MediaStorage.reconcile -> removing orphan {file_path.name}")
+            file_path.unlink(missing_ok=True)
+
+        missing = tracked - on_disk
+        if len(missing) != 0:
+            await MediaFile.filter(path__in=list(missing)).delete()
+
+        untracked = on_disk - tracked
+        if len(untracked) != 0:
+            now = datetime.now(timezone.utc)
+            await MediaFile.bulk_create(
+                [
+                    MediaFile(
+                        path=path,
+                        feed_entry_id=referenced[path],
+                        size=self._static_path.joinpath(path).stat().st_size,
+                        last_access=now,
+                    )
+                    for path in untracked
+                ],
+                ignore_conflicts=True,
+            )
+
+
+async def update_media_storage(media_storage: MediaStorage):
+    logging.debug("update_media_storage")
+
+    await media_storage.flush_access_times()
+    await media_storage.reconcile()
+    await media_storage.enforce_budget()
+
+    logging.debug("update_media_storage -> done")
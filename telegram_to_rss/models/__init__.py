@@ -1,2 +1,4 @@
 from .feed import *
 from .feed_entry import *
+from .media_file import *
+from .websub_subscription import *
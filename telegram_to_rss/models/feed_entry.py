@@ -16,6 +16,11 @@ class FeedEntry(Model):
     date = fields.DatetimeField()
     media = fields.JSONField(default=[])
     has_unsupported_media = fields.BooleanField(default=False)
+    # Precomputed RSS item fragments, see telegram_to_rss.render
+    title = fields.TextField(null=True)
+    link = fields.TextField(null=True)
+    description = fields.TextField(null=True)
+    render_version = fields.TextField(null=True)
 
 
 @post_delete(FeedEntry)
@@ -0,0 +1,12 @@
+from tortoise.models import Model
+from tortoise import fields
+
+
+class MediaFile(Model):
+    path = fields.TextField(primary_key=True)
+    feed_entry = fields.ForeignKeyField(
+        "models.FeedEntry", on_delete=fields.CASCADE, related_name="media_files"
+    )
+    size = fields.BigIntField()
+    created = fields.DatetimeField(auto_now_add=True)
+    last_access = fields.DatetimeField()
@@ -0,0 +1,23 @@
+from tortoise.models import Model
+from tortoise import fields
+
+
+class WebSubSubscription(Model):
+    id = fields.IntField(primary_key=True)
+    # Not a foreign key, subscriptions outlive feeds rebuilt from scratch
+    feed_id = fields.BigIntField(db_index=True)
+    topic = fields.TextField()
+    callback = fields.TextField()
+    secret = fields.TextField(null=True)
+    lease_expires = fields.DatetimeField()
+    # Content distribution state, one pending delivery per subscription
+    pending = fields.BooleanField(default=False)
+    attempts = fields.IntField(default=0)
+    next_attempt = fields.DatetimeField(null=True)
+    # Bumped on every publish, a delivery only settles the version it sent
+    content_version = fields.IntField(default=0)
+    # Digest of the feed items last sent, so restarts do not resend them
+    published_digest = fields.TextField(null=True)
+
+    class Meta:
+        unique_together = (("feed_id", "callback"),)
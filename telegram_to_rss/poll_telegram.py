@@ -1,8 +1,17 @@
 from typing import Union
 from telethon.tl.custom import Message
 from telethon.types import Document, Photo
+from telethon import utils
 from telegram_to_rss.client import TelegramToRssClient, custom, types
 from telegram_to_rss.models import Feed, FeedEntry
+from telegram_to_rss.download import (
+    DOWNLOAD_INTERRUPTED_ERRORS,
+    download_document,
+    download_photo,
+)
+from telegram_to_rss.media_storage import MediaStorage
+from telegram_to_rss.profiling import profile_stage
+from telegram_to_rss.render import render_feed_entry, to_telegram_url
 from tortoise.expressions import Q
 from tortoise.transactions import atomic
 from pathlib import Path
@@ -14,7 +23,9 @@ class TelegramPoller:
     _message_limit: int
     _new_feed_limit: int
     _static_path: Path
+    _partial_path: Path
     _max_media_size: int
+    _media_storage: MediaStorage
 
     def __init__(
         self,
@@ -22,13 +33,17 @@ class TelegramPoller:
         message_limit: int,
         new_feed_limit: int,
         static_path: Path,
+        partial_path: Path,
         max_media_size: int,
+        media_storage: MediaStorage,
     ) -> None:
         self._client = client
         self._message_limit = message_limit
         self._new_feed_limit = new_feed_limit
         self._static_path = static_path
+        self._partial_path = partial_path
         self._max_media_size = max_media_size
+        self._media_storage = media_storage
 
 
     async def fetch_dialogs(self):
@@ -57,6 +72,20 @@ class TelegramPoller:
             return
         if len(ids) != 0:
             await Feed.filter(Q(id__in=list(ids))).delete()
+            # Excluded or deleted dialogs should not stay readable
+            for id in ids:
+                self._static_path.joinpath("{}.xml".format(id)).unlink(missing_ok=True)
+
+    async def enforce_media_budget(self):
+        # Runs after every feed, a new feed or a long backlog downloads enough
+        # media in one cycle to fill the volume before the cycle ends
+        try:
+            await self._media_storage.flush_access_times()
+            await self._media_storage.enforce_budget()
+        except Exception as e:
+            logging.error(
+                f"TelegramPoller.enforce_media_budget -> error: {e}", exc_info=True
+            )
 
     @atomic()
     async def create_feed(self, dialog: custom.Dialog):
@@ -65,14 +94,19 @@ class TelegramPoller:
         feed = await Feed.create(id=dialog.id, name=dialog.name)
 
         logging.debug("TelegramPoller.create_feed -> get_dialog_messages")
-        dialog_messages = await self._client.get_dialog_messages(
-            dialog=dialog, limit=self._new_feed_limit
-        )
+        async with profile_stage("get_dialog_messages", feed.id):
+            dialog_messages = await self._client.get_dialog_messages(
+                dialog=dialog, limit=self._new_feed_limit
+            )
         logging.debug("TelegramPoller.create_feed -> _process_new_dialog_messages")
-        feed_entries = await self._process_new_dialog_messages(feed, dialog_messages)
+        async with profile_stage("process_new_dialog_messages", feed.id):
+            feed_entries = await self._process_new_dialog_messages(
+                feed, dialog_messages
+            )
 
         logging.debug("TelegramPoller.create_feed -> bulk_create")
         await FeedEntry.bulk_create(feed_entries)
+        await self._media_storage.register(feed_entries)
 
     @atomic()
     async def update_feed(self, dialog: custom.Dialog):
@@ -92,9 +126,10 @@ class TelegramPoller:
                 f"TelegramPoller.update_feed -> feed {feed.name} ({feed.id}) does not have associated feed entries"
             )
 
-        new_dialog_messages = await self._client.get_dialog_messages(
-            dialog=dialog, **get_dialog_messages_args
-        )
+        async with profile_stage("get_dialog_messages", feed.id):
+            new_dialog_messages = await self._client.get_dialog_messages(
+                dialog=dialog, **get_dialog_messages_args
+            )
 
         for new_message in new_dialog_messages:
             if new_message.date is None:
@@ -108,11 +143,13 @@ class TelegramPoller:
                 )
                 continue
 
-        feed_entries = await self._process_new_dialog_messages(
-            feed, new_dialog_messages
-        )
+        async with profile_stage("process_new_dialog_messages", feed.id):
+            feed_entries = await self._process_new_dialog_messages(
+                feed, new_dialog_messages
+            )
 
         await FeedEntry.bulk_create(feed_entries)
+        await self._media_storage.register(feed_entries)
         # Save even if unchanged to update date
         await feed.save()
 
@@ -174,23 +211,33 @@ class TelegramPoller:
                         continue
                     await self._download_media(dialog_message, last_processed_message, feed, mime_type)
 
+            except DOWNLOAD_INTERRUPTED_ERRORS:
+                raise
             except Exception as e:
                 logging.error(f"Error processing message {dialog_message.id}: {e}", exc_info=True)
                 continue
 
         feed_entries: list[FeedEntry] = []
+        if len(filtered_dialog_messages) == 0:
+            return feed_entries
+
+        tg_id_or_username = await self._client.telethon_dialog_id_to_tg_id_or_username(
+            feed.id
+        )
         for dialog_message in filtered_dialog_messages:
             feed_entry_id = to_feed_entry_id(feed, dialog_message)
-            feed_entries.append(
-                FeedEntry(
-                    id=feed_entry_id,
-                    feed=feed,
-                    message=dialog_message.text,
-                    date=dialog_message.date,
-                    media=dialog_message.downloaded_media,
-                    has_unsupported_media=getattr(dialog_message, 'has_unsupported_media', False),
-                )
+            feed_entry = FeedEntry(
+                id=feed_entry_id,
+                feed=feed,
+                message=dialog_message.text,
+                date=dialog_message.date,
+                media=dialog_message.downloaded_media,
+                has_unsupported_media=getattr(dialog_message, 'has_unsupported_media', False),
             )
+            render_feed_entry(
+                feed_entry, to_telegram_url(tg_id_or_username, dialog_message.id)
+            )
+            feed_entries.append(feed_entry)
         return feed_entries
 
     async def _download_media(self, dialog_message: Message, last_processed_message, feed, media_type):
@@ -199,20 +246,29 @@ class TelegramPoller:
                 to_feed_entry_id(feed, dialog_message),
                 len(last_processed_message.downloaded_media),
             )
-            media_path = self._static_path.joinpath(feed_entry_media_id)
 
-            def progress_callback(current, total, media_path=media_path):
-                logging.debug(
-                    "Downloading %s %s: %s out of %s",
-                    media_type,
+            if media_type == "photo":
+                media_path = self._static_path.joinpath(
+                    feed_entry_media_id + utils.get_extension(dialog_message.photo)
+                )
+                await download_photo(dialog_message, media_path, self._partial_path)
+            else:
+                media_path = self._static_path.joinpath(
+                    feed_entry_media_id + utils.get_extension(dialog_message.document)
+                )
+                await download_document(
+                    dialog_message.client,
+                    dialog_message.document,
                     media_path,
-                    current,
-                    total,
+                    self._partial_path,
                 )
 
-            res_path = await dialog_message.download_media(file=media_path, progress_callback=progress_callback)
-            last_processed_message.downloaded_media.append(Path(res_path).name)
-            logging.info(f"Downloaded {media_type} to {res_path}")
+            last_processed_message.downloaded_media.append(media_path.name)
+            logging.info(f"Downloaded {media_type} to {media_path}")
+        except DOWNLOAD_INTERRUPTED_ERRORS:
+            # The partial file is kept, the feed update is rolled back and
+            # retried by update_rss after reconnecting, resuming the download
+            raise
         except Exception as e:
             logging.warning(
                 f"Downloading {media_type} failed with {e} for message {dialog_message.id} {dialog_message.date} {dialog_message.text}",
@@ -260,6 +316,7 @@ async def update_feeds_in_db(telegram_poller: TelegramPoller):
             feed_to_create.name,
         )
         await telegram_poller.create_feed(feed_to_create)
+        await telegram_poller.enforce_media_budget()
         logging.debug("update_feeds_in_db.create_feed -> done")
 
     for feed_to_update in feeds_to_update:
@@ -269,4 +326,5 @@ async def update_feeds_in_db(telegram_poller: TelegramPoller):
             feed_to_update.name,
         )
         await telegram_poller.update_feed(feed_to_update)
+        await telegram_poller.enforce_media_budget()
         logging.debug("update_feeds_in_db.update_feed -> done")
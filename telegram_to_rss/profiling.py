@@ -0,0 +1,157 @@
+import cProfile
+import json
+import logging
+import sys
+import time
+from collections import Counter
+from contextlib import asynccontextmanager
+from contextvars import ContextVar
+from datetime import datetime
+from pathlib import Path
+
+SAMPLE_INTERVAL_SECONDS = 0.005
+MAX_SAMPLE_SECONDS = 300
+
+
+def _collapse_frame_stack(frame) -> str:
+    stack: list[str] = []
+    while frame is not None:
+        code = frame.f_code
+        stack.append("{}:{}".format(Path(code.co_filename).name, code.co_qualname))
+        frame = frame.f_back
+    stack.reverse()
+    return ";".join(stack)
+
+
+def sample_thread_stacks(
+    thread_id: int, seconds: float, interval: float = SAMPLE_INTERVAL_SECONDS
+) -> str:
+    """Samples the stack of a thread for a while and returns it in the collapsed
+    format understood by flamegraph.pl, speedscope and friends.
+
+    Blocks the calling thread, run it in an executor when called from the
+    event loop thread that is being sampled.
+    """
+    samples: Counter[str] = Counter()
+    deadline = time.monotonic() + seconds
+
+    while time.monotonic() < deadline:
+        frame = sys._current_frames().get(thread_id)
+        if frame is None:
+            break
+        samples[_collapse_frame_stack(frame)] += 1
+        # Drop our reference quickly, frames keep their locals alive
+        del frame
+        time.sleep(interval)
+
+    return "".join(
+        "{} {}\n".format(stack, count) for stack, count in samples.most_common()
+    )
+
+
+class CycleProfiler:
+    """Times the stages of update_rss and writes a cProfile dump for every
+    Nth cycle. Stage timing is a couple of perf_counter calls, with
+    every_n_cycles set to 0 nothing else runs.
+
+    Stages are summed up per name and, for the ones run for a single feed,
+    per feed as well. Code deeper in the pipeline times itself with
+    profile_stage, which finds the running cycle through a context variable.
+
+    The profile covers the whole event loop thread while the cycle runs,
+    so requests served in the meantime show up in it as well.
+    """
+
+    _profile_path: Path
+    _every_n_cycles: int
+    _cycle: int = 0
+    _profile: cProfile.Profile | None = None
+    _timings: dict[str, dict[str, float]]
+    _feed_timings: dict[int, dict[str, float]]
+
+    def __init__(self, profile_path: Path, every_n_cycles: int) -> None:
+        self._profile_path = profile_path
+        self._every_n_cycles = every_n_cycles
+        self._timings = {}
+        self._feed_timings = {}
+
+    def start_cycle(self):
+        self._cycle += 1
+        self._timings = {}
+        self._feed_timings = {}
+        _current_profiler.set(self)
+
+        if self._every_n_cycles > 0 and self._cycle % self._every_n_cycles == 0:
+            self._profile = cProfile.Profile()
+            try:
+                self._profile.enable()
+            except ValueError as e:
+                # Another profiler is already active on this thread
+                logging.warning(f"CycleProfiler.start_cycle -> cannot profile: {e}")
+                self._profile = None
+
+    @asynccontextmanager
+    async def stage(self, name: str, feed_id: int | None = None):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            timing = self._timings.setdefault(name, {"seconds": 0, "count": 0})
+            timing["seconds"] += elapsed
+            timing["count"] += 1
+            if feed_id is not None:
+                feed_timing = self._feed_timings.setdefault(feed_id, {})
+                feed_timing[name] = feed_timing.get(name, 0) + elapsed
+
+    def finish_cycle(self):
+        _current_profiler.set(None)
+        logging.debug("CycleProfiler.finish_cycle %s %s", self._cycle, self._timings)
+
+        if self._profile is None:
+            return
+
+        self._profile.disable()
+        profile = self._profile
+        self._profile = None
+
+        file_stem = "cycle-{}-{}".format(
+            self._cycle, datetime.now().strftime("%Y%m%d-%H%M%S")
+        )
+        # Slowest feeds first
+        feed_timings = dict(
+            sorted(
+                self._feed_timings.items(),
+                key=lambda item: sum(item[1].values()),
+                reverse=True,
+            )
+        )
+        try:
+            self._profile_path.mkdir(mode=0o700, exist_ok=True)
+            profile.dump_stats(self._profile_path.joinpath(file_stem + ".pstats"))
+            self._profile_path.joinpath(file_stem + ".timings.json").write_text(
+                json.dumps({"stages": self._timings, "feeds": feed_timings}, indent=2)
+            )
+        except OSError as e:
+            logging.error(f"CycleProfiler.finish_cycle -> cannot write {file_stem}: {e}")
+            return
+
+        logging.info(
+            "CycleProfiler.finish_cycle -> wrote %s %s", file_stem, self._timings
+        )
+
+
+_current_profiler: ContextVar[CycleProfiler | None] = ContextVar(
+    "current_profiler", default=None
+)
+
+
+@asynccontextmanager
+async def profile_stage(name: str, feed_id: int | None = None):
+    """Times a stage of the running update_rss cycle, if there is one."""
+    profiler = _current_profiler.get()
+    if profiler is None:
+        yield
+        return
+    async with profiler.stage(name, feed_id):
+        yield
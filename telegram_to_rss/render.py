@@ -0,0 +1,106 @@
+import mimetypes
+import re
+from typing import Union
+
+from telegram_to_rss.config import base_url
+from telegram_to_rss.models import FeedEntry
+
+# Bump whenever the HTML produced by render_feed_entry changes, so stored
+# fragments get re-rendered on the next feed generation.
+RENDER_VERSION = 1
+
+RENDERED_FIELDS = ["title", "link", "description", "render_version"]
+
+CLEAN_TITLE = re.compile("<.*?>")
+
+
+def clean_title(raw_html):
+    cleantext = re.sub(CLEAN_TITLE, "", raw_html).replace("\n", " ").strip()
+    return cleantext
+
+
+def current_render_version():
+    return "{}|{}".format(RENDER_VERSION, base_url)
+
+
+def to_telegram_url(tg_id_or_username: Union[str, int], message_id: int | None = None):
+    if isinstance(tg_id_or_username, int):
+        url = f"https://t.me/c/{tg_id_or_username}"
+    else:
+        url = f"https://t.me/{tg_id_or_username}"
+    if message_id is not None:
+        url += f"/{message_id}"
+    return url
+
+
+def render_media(media: list[str]):
+    media_content = ""
+    media_download_failure = 0
+    media_too_large = 0
+    media_evicted = 0
+
+    for media_path in media:
+        if media_path == "FAIL":
+            media_download_failure += 1
+        elif media_path == "TOO_LARGE":
+            media_too_large += 1
+        elif media_path == "EVICTED":
+            media_evicted += 1
+        else:
+            media_url = "{}/static/{}".format(base_url, media_path)
+
+            # checking file type
+            mime = mimetypes.guess_type(media_url)[0] or ""
+            mtype = mime.split("/")[0]
+            if mtype == "image":
+                media_content += '<br /><img src="{}" alt="media"/>'.format(media_url)
+            elif mtype == "video":
+                media_content += (
+                    '<br /><video controls poster="{}" style="max-width:100%;">'
+                    '<source src="{}" type="{}">'
+                    "Your browser does not support the video tag.</video>"
+                ).format(media_url, media_url, mime)
+            elif mtype == "audio":
+                media_content += (
+                    '<br /><audio controls><source src="{}" type="{}"></audio>'.format(
+                        media_url, mime
+                    )
+                )
+            else:
+                media_content += '<br /><a href="{}">{}</a>'.format(
+                    media_url, media_path
+                )
+
+    return media_content, media_download_failure, media_too_large, media_evicted
+
+
+def render_feed_entry(feed_entry: FeedEntry, link: str):
+    """Fill in the precomputed title, link and description of a feed entry.
+
+    Does not save the entry, callers batch the writes.
+    """
+    feed_entry.link = link
+    feed_entry.title = clean_title(feed_entry.message)[:100]
+
+    [media_content, media_download_failure, media_too_large, media_evicted] = (
+        render_media(feed_entry.media)
+    )
+
+    # creating feed with text and media
+    content = feed_entry.message.replace("\n", "<br />") + media_content
+    if feed_entry.has_unsupported_media:
+        content += "<br /><strong>This message has unsupported attachment. Open Telegram to view it.</strong>"
+    if media_download_failure > 0:
+        content += f"<br /><strong>{media_download_failure} attachment(s) of this message has failed to download. Open Telegram to view it.</strong>"
+    if media_too_large:
+        content += f"<br /><strong>{media_too_large} attachment(s) of this message is too large to download. Open Telegram to view it.</strong>"
+    if media_evicted:
+        content += (
+            f"<br /><strong>{media_evicted} attachment(s) of this message has been"
+            f' removed to save disk space. <a href="{link}">Open Telegram</a>'
+            " to view it.</strong>"
+        )
+
+    feed_entry.description = content
+    feed_entry.render_version = current_render_version()
+    return feed_entry
@@ -1,29 +1,58 @@
 import asyncio
+import hmac
+import threading
 from typing import Optional
-from quart import Quart, render_template
+from quart import Quart, Response, abort, render_template, request
 from telegram_to_rss.client import TelegramToRssClient
+from telegram_to_rss.dialog_rules import DialogRules
 from telegram_to_rss.config import (
     api_hash,
     api_id,
     session_path,
     password,
     static_path,
+    partial_path,
     feed_size_limit,
     initial_feed_size,
     update_interval_seconds,
     db_path,
     loglevel,
     max_media_size,
+    max_media_storage,
+    debug_token,
+    profile_every_n_cycles,
+    profile_path,
+    dialog_types,
+    include_archived,
+    include_folders,
+    exclude_folders,
+    include_dialog_ids,
+    exclude_dialog_ids,
+    dialog_refresh_interval_seconds,
+    base_url,
+    websub_workers,
+    websub_allow_private_callbacks,
 )
 from telegram_to_rss.qr_code import get_qr_code_image
 from telegram_to_rss.db import init_feeds_db, close_feeds_db
 from telegram_to_rss.generate_feed import update_feeds_cache
+from telegram_to_rss.media_storage import MediaStorage, update_media_storage
 from telegram_to_rss.poll_telegram import (
     TelegramPoller,
     update_feeds_in_db,
     reset_feeds_in_db,
 )
 from telegram_to_rss.models import Feed
+from telegram_to_rss.consts import (
+    WEBSUB_DEFAULT_LEASE_SECONDS,
+    WEBSUB_MAX_LEASE_SECONDS,
+)
+from telegram_to_rss.websub import WebSubHub
+from telegram_to_rss.profiling import (
+    MAX_SAMPLE_SECONDS,
+    CycleProfiler,
+    sample_thread_stacks,
+)
 import logging
 
 logging.basicConfig(
@@ -34,14 +63,44 @@ logging.basicConfig(
 
 app = Quart(__name__, static_folder=static_path, static_url_path="/static")
 client = TelegramToRssClient(
-    session_path=session_path, api_id=api_id, api_hash=api_hash, password=password
+    session_path=session_path,
+    api_id=api_id,
+    api_hash=api_hash,
+    password=password,
+    dialog_rules=DialogRules(
+        dialog_types=dialog_types,
+        include_archived=include_archived,
+        include_folders=include_folders,
+        exclude_folders=exclude_folders,
+        include_ids=include_dialog_ids,
+        exclude_ids=exclude_dialog_ids,
+    ),
+    dialog_refresh_interval=dialog_refresh_interval_seconds,
+)
+media_storage = MediaStorage(
+    static_path=static_path, partial_path=partial_path, max_size=max_media_storage
 )
 telegram_poller = TelegramPoller(
     client=client,
     message_limit=feed_size_limit,
     new_feed_limit=initial_feed_size,
     static_path=static_path,
+    partial_path=partial_path,
     max_media_size=max_media_size,
+    media_storage=media_storage,
+)
+websub_hub = (
+    WebSubHub(
+        base_url=base_url,
+        static_path=static_path,
+        worker_count=websub_workers,
+        allow_private_callbacks=websub_allow_private_callbacks,
+    )
+    if websub_workers > 0
+    else None
+)
+cycle_profiler = CycleProfiler(
+    profile_path=profile_path, every_n_cycles=profile_every_n_cycles
 )
 rss_task: asyncio.Task | None = None
 
@@ -59,20 +118,46 @@ async def start_rss_generation():
         should_reschedule = True
         reschedule_delay = None
         try:
-            logging.info("update_rss -> db")
-            await update_feeds_in_db(telegram_poller=telegram_poller)
+            cycle_profiler.start_cycle()
+            try:
+                logging.info("update_rss -> db")
+                async with cycle_profiler.stage("update_feeds_in_db"):
+                    await update_feeds_in_db(telegram_poller=telegram_poller)
 
-            logging.info("update_rss -> cache")
-            await update_feeds_cache(telegram_poller=telegram_poller, feed_render_dir=static_path)
+                logging.info("update_rss -> media")
+                try:
+                    async with cycle_profiler.stage("update_media_storage"):
+                        await update_media_storage(media_storage=media_storage)
+                except Exception as e:
+                    # Feeds are fine, the next cycle tries again
+                    logging.error(f"update_rss -> media error: {e}", exc_info=True)
+
+                logging.info("update_rss -> cache")
+                async with cycle_profiler.stage("update_feeds_cache"):
+                    await update_feeds_cache(
+                        telegram_poller=telegram_poller,
+                        feed_render_dir=static_path,
+                        websub_hub=websub_hub,
+                    )
+            finally:
+                cycle_profiler.finish_cycle()
 
             logging.info("update_rss -> sleep")
             await asyncio.sleep(update_interval_seconds)
         except asyncio.CancelledError:
             should_reschedule = False
-        except ConnectionError as e:
+        except (ConnectionError, TimeoutError) as e:
             reschedule_delay = 5
-            logging.warning(f"update_rss -> connection error, reconnecting telethon: {e}")
-            await telegram_poller._client._telethon.connect()
+            if telegram_poller._client._telethon.is_connected():
+                # e.g. a slow download, resumed by the next run
+                logging.warning(f"update_rss -> timed out, retrying: {e}")
+            else:
+                logging.warning(
+                    f"update_rss -> connection error, reconnecting telethon: {e}"
+                )
+                await telegram_poller._client._telethon.connect()
+                # Dialog updates may have been missed while disconnected
+                telegram_poller._client.invalidate_dialogs()
         except Exception as e:
             reschedule_delay = 2
             logging.error(f"update_rss -> error: {e}")
@@ -99,6 +184,8 @@ async def startup():
     logging.info("startup")
 
     await init_feeds_db(db_path=db_path)
+    if websub_hub is not None:
+        websub_hub.start()
     loop = asyncio.get_event_loop()
     rss_task = loop.create_task(start_rss_generation())
 
@@ -111,12 +198,21 @@ async def cleanup():
 
     if rss_task is not None:
         rss_task.cancel()
+    if websub_hub is not None:
+        await websub_hub.stop()
     await client.stop()
     await close_feeds_db()
 
     logging.info("cleanup -> done")
 
 
+@app.after_request
+async def track_media_access(response):
+    if request.path.startswith("/static/") and response.status_code < 400:
+        media_storage.touch(request.path.removeprefix("/static/"))
+    return response
+
+
 @app.route("/")
 async def root():
     logging.debug("GET /root %s", bool(client.qr_code_url))
@@ -129,3 +225,65 @@ async def root():
     logging.debug("GET /root -> feeds %s", len(feeds))
 
     return await render_template("feeds.html", user=client.user, feeds=feeds)
+
+
+@app.route("/websub", methods=["POST"])
+async def websub():
+    if websub_hub is None:
+        abort(404)
+
+    form = await request.form
+    mode = form.get("hub.mode")
+    topic = form.get("hub.topic", "")
+    callback = form.get("hub.callback", "")
+    secret = form.get("hub.secret") or None
+    lease_seconds = form.get(
+        "hub.lease_seconds", WEBSUB_DEFAULT_LEASE_SECONDS, type=int
+    )
+    logging.debug("POST /websub %s %s %s", mode, topic, callback)
+
+    if mode not in ("subscribe", "unsubscribe"):
+        return "Unsupported hub.mode", 400
+    if not await websub_hub.is_callback_allowed(callback):
+        return "Invalid hub.callback", 400
+    if secret is not None and len(secret.encode()) >= 200:
+        return "hub.secret is too long", 400
+    feed_id = websub_hub.parse_topic_url(topic)
+    if feed_id is None or (
+        mode == "subscribe" and not await Feed.exists(id=feed_id)
+    ):
+        return "Unknown hub.topic", 400
+    lease_seconds = max(1, min(lease_seconds, WEBSUB_MAX_LEASE_SECONDS))
+
+    is_submitted = websub_hub.submit(
+        lambda: websub_hub.verify(
+            mode=mode,
+            feed_id=feed_id,
+            topic=topic,
+            callback=callback,
+            secret=secret,
+            lease_seconds=lease_seconds,
+        )
+    )
+    if not is_submitted:
+        return "Hub is busy, try again later", 503
+    return "", 202
+
+
+@app.route("/debug/profile")
+async def debug_profile():
+    authorization = request.headers.get("Authorization", "")
+    if not debug_token or not hmac.compare_digest(
+        authorization.encode(), "Bearer {}".format(debug_token).encode()
+    ):
+        abort(404)
+
+    seconds = request.args.get("seconds", 10, type=float)
+    seconds = max(0, min(seconds, MAX_SAMPLE_SECONDS))
+    logging.info("GET /debug/profile %s", seconds)
+
+    loop = asyncio.get_running_loop()
+    collapsed_stacks = await loop.run_in_executor(
+        None, sample_thread_stacks, threading.get_ident(), seconds
+    )
+    return Response(collapsed_stacks, mimetype="text/plain")
@@ -0,0 +1,351 @@
+import asyncio
+import hashlib
+import hmac
+import http.client
+import logging
+import ipaddress
+import secrets
+import socket
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+from typing import Awaitable, Callable
+from urllib.parse import urlencode, urlparse
+
+from telegram_to_rss.consts import (
+    WEBSUB_DISPATCH_INTERVAL_SECONDS,
+    WEBSUB_HTTP_TIMEOUT_SECONDS,
+    WEBSUB_MAX_ATTEMPTS,
+    WEBSUB_RETRY_DELAY_SECONDS,
+)
+from telegram_to_rss.models import WebSubSubscription
+from tortoise.expressions import F, Q
+
+# Subscribers only echo the challenge back, no need to read more than that
+MAX_RESPONSE_SIZE = 64 * 1024
+
+
+def resolve_addresses(
+    host: str,
+) -> list[ipaddress.IPv4Address | ipaddress.IPv6Address]:
+    try:
+        address_infos = socket.getaddrinfo(host, None)
+    except (socket.gaierror, UnicodeError):
+        return []
+
+    addresses = []
+    for address_info in address_infos:
+        address = ipaddress.ip_address(address_info[4][0].split("%")[0])
+        if address.version == 6 and address.ipv4_mapped is not None:
+            address = address.ipv4_mapped
+        addresses.append(address)
+    return addresses
+
+
+def is_public_host(host: str) -> bool:
+    addresses = resolve_addresses(host)
+    return len(addresses) != 0 and all(address.is_global for address in addresses)
+
+
+def _pin_connection(connection: http.client.HTTPConnection, address: str):
+    # The host name is resolved again on connect, and could then point
+    # somewhere else than the address that was checked (DNS rebinding).
+    # Host header and TLS server name still use connection.host.
+    def create_connection(host_and_port, *args):
+        return socket.create_connection((address, host_and_port[1]), *args)
+
+    connection._create_connection = create_connection
+
+
+def _http_request(
+    method: str,
+    url: str,
+    body: bytes | None = None,
+    headers: dict[str, str] | None = None,
+    allow_private: bool = False,
+) -> tuple[int, bytes]:
+    parsed_url = urlparse(url)
+    host = parsed_url.hostname
+    if parsed_url.scheme == "https":
+        connection = http.client.HTTPSConnection(
+            host, parsed_url.port, timeout=WEBSUB_HTTP_TIMEOUT_SECONDS
+        )
+    elif parsed_url.scheme == "http":
+        connection = http.client.HTTPConnection(
+            host, parsed_url.port, timeout=WEBSUB_HTTP_TIMEOUT_SECONDS
+        )
+    else:
+        raise Exception(f"unsupported scheme {parsed_url.scheme}")
+
+    if not allow_private:
+        addresses = resolve_addresses(host) if host is not None else []
+        if len(addresses) == 0 or not all(address.is_global for address in addresses):
+            raise Exception(f"{host} does not resolve to a public address")
+        _pin_connection(connection, str(addresses[0]))
+
+    path = parsed_url.path or "/"
+    if parsed_url.query:
+        path += "?" + parsed_url.query
+    # http.client never follows redirects, which could point the hub at an
+    # address the callback check refused
+    try:
+        connection.request(method, path, body=body, headers=headers or {})
+        response = connection.getresponse()
+        return response.status, response.read(MAX_RESPONSE_SIZE)
+    finally:
+        connection.close()
+
+
+async def http_request(
+    method: str,
+    url: str,
+    body: bytes | None = None,
+    headers: dict[str, str] | None = None,
+    allow_private: bool = False,
+) -> tuple[int, bytes]:
+    return await asyncio.to_thread(
+        _http_request, method, url, body, headers, allow_private
+    )
+
+
+class WebSubHub:
+    """A WebSub hub for the feeds rendered by this app.
+
+    Subscription intents are verified and content is distributed by a fixed
+    number of workers. Subscriptions, their leases and pending deliveries are
+    kept in WebSubSubscription rows, so retries survive restarts.
+    """
+
+    _base_url: str
+    _static_path: Path
+    _worker_count: int
+    _queue: asyncio.Queue[Callable[[], Awaitable[None]]]
+    _tasks: list[asyncio.Task]
+    _in_flight: set[int]
+    _wakeup: asyncio.Event
+    _allow_private_callbacks: bool
+
+    def __init__(
+        self,
+        base_url: str,
+        static_path: Path,
+        worker_count: int,
+        allow_private_callbacks: bool = False,
+    ) -> None:
+        self._base_url = base_url
+        self._static_path = static_path
+        self._worker_count = worker_count
+        self._allow_private_callbacks = allow_private_callbacks
+        self._tasks = []
+        self._in_flight = set()
+
+    @property
+    def hub_url(self):
+        return "{}/websub".format(self._base_url)
+
+    def topic_url(self, feed_id: int):
+        return "{}/static/{}.xml".format(self._base_url, feed_id)
+
+    def parse_topic_url(self, topic: str) -> int | None:
+        prefix = "{}/static/".format(self._base_url)
+        if not topic.startswith(prefix) or not topic.endswith(".xml"):
+            return None
+        try:
+            return int(topic[len(prefix) : -len(".xml")])
+        except ValueError:
+            return None
+
+    async def is_callback_allowed(self, callback: str):
+        parsed_callback = urlparse(callback)
+        if parsed_callback.scheme not in ("http", "https"):
+            return False
+        if parsed_callback.hostname is None:
+            return False
+        if self._allow_private_callbacks:
+            return True
+        return await asyncio.to_thread(is_public_host, parsed_callback.hostname)
+
+    def start(self):
+        self._queue = asyncio.Queue(maxsize=self._worker_count * 4)
+        self._wakeup = asyncio.Event()
+        loop = asyncio.get_event_loop()
+        self._tasks = [loop.create_task(self._dispatch())] + [
+            loop.create_task(self._work()) for _ in range(self._worker_count)
+        ]
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    def submit(self, job: Callable[[], Awaitable[None]]) -> bool:
+        try:
+            self._queue.put_nowait(job)
+            return True
+        except asyncio.QueueFull:
+            return False
+
+    async def publish(self, feed_id: int, content_digest: str):
+        now = datetime.now(timezone.utc)
+        count = (
+            await WebSubSubscription.filter(feed_id=feed_id, lease_expires__gt=now)
+            .filter(
+                Q(published_digest__isnull=True)
+                | ~Q(published_digest=content_digest)
+            )
+            .update(
+                pending=True,
+                attempts=0,
+                next_attempt=now,
+                content_version=F("content_version") + 1,
+                published_digest=content_digest,
+            )
+        )
+        if count:
+            logging.debug("WebSubHub.publish %s -> %s subscribers", feed_id, count)
+            self._wakeup.set()
+
+    async def verify(
+        self,
+        mode: str,
+        feed_id: int,
+        topic: str,
+        callback: str,
+        secret: str | None,
+        lease_seconds: int,
+    ):
+        challenge = secrets.token_urlsafe(32)
+        query = {
+            "hub.mode": mode,
+            "hub.topic": topic,
+            "hub.challenge": challenge,
+        }
+        if mode == "subscribe":
+            query["hub.lease_seconds"] = lease_seconds
+        verify_url = "{}{}{}".format(
+            callback, "&" if "?" in callback else "?", urlencode(query)
+        )
+
+        try:
+            status, body = await http_request(
+                "GET", verify_url, allow_private=self._allow_private_callbacks
+            )
+        except Exception as e:
+            logging.info(f"WebSubHub.verify {mode} {callback} -> failed with {e}")
+            return
+        if not 200 <= status < 300 or body.decode(errors="replace") != challenge:
+            logging.info(f"WebSubHub.verify {mode} {callback} -> not confirmed {status}")
+            return
+
+        if mode == "subscribe":
+            await WebSubSubscription.update_or_create(
+                feed_id=feed_id,
+                callback=callback,
+                defaults={
+                    "topic": topic,
+                    "secret": secret,
+                    "lease_expires": datetime.now(timezone.utc)
+                    + timedelta(seconds=lease_seconds),
+                },
+            )
+        else:
+            await WebSubSubscription.filter(feed_id=feed_id, callback=callback).delete()
+        logging.info(f"WebSubHub.verify {mode} {topic} {callback} -> done")
+
+    async def _work(self):
+        while True:
+            job = await self._queue.get()
+            try:
+                await job()
+            except Exception as e:
+                logging.error(f"WebSubHub._work -> error: {e}", exc_info=True)
+            finally:
+                self._queue.task_done()
+
+    async def _dispatch(self):
+        while True:
+            try:
+                now = datetime.now(timezone.utc)
+                await WebSubSubscription.filter(lease_expires__lte=now).delete()
+
+                due_query = WebSubSubscription.filter(pending=True, next_attempt__lte=now)
+                if len(self._in_flight) != 0:
+                    due_query = due_query.exclude(id__in=list(self._in_flight))
+                due = await due_query.order_by("next_attempt").limit(self._queue.maxsize)
+                for subscription in due:
+                    self._in_flight.add(subscription.id)
+                    # Blocks while the workers are busy, bounding the backlog
+                    await self._queue.put(
+                        lambda subscription=subscription: self._deliver(subscription)
+                    )
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logging.error(f"WebSubHub._dispatch -> error: {e}", exc_info=True)
+
+            try:
+                await asyncio.wait_for(
+                    self._wakeup.wait(), timeout=WEBSUB_DISPATCH_INTERVAL_SECONDS
+                )
+            except TimeoutError:
+                pass
+            self._wakeup.clear()
+
+    async def _deliver(self, subscription: WebSubSubscription):
+        # A publish during the delivery bumps content_version, so the updates
+        # below only apply if the delivered content is still the latest one
+        delivered = WebSubSubscription.filter(
+            id=subscription.id, content_version=subscription.content_version
+        )
+        try:
+            body = self._static_path.joinpath(
+                "{}.xml".format(subscription.feed_id)
+            ).read_bytes()
+            headers = {
+                "Content-Type": "application/rss+xml",
+                "Link": '<{}>; rel="hub", <{}>; rel="self"'.format(
+                    self.hub_url, subscription.topic
+                ),
+            }
+            if subscription.secret:
+                signature = hmac.new(
+                    subscription.secret.encode(), body, hashlib.sha256
+                ).hexdigest()
+                headers["X-Hub-Signature"] = "sha256={}".format(signature)
+
+            status, _ = await http_request(
+                "POST",
+                subscription.callback,
+                body=body,
+                headers=headers,
+                allow_private=self._allow_private_callbacks,
+            )
+            if status == 410:
+                logging.info(
+                    f"WebSubHub._deliver {subscription.callback} -> gone, unsubscribing"
+                )
+                await WebSubSubscription.filter(id=subscription.id).delete()
+                return
+            if not 200 <= status < 300:
+                raise Exception(f"subscriber responded with {status}")
+
+            await delivered.update(pending=False, attempts=0)
+        except Exception as e:
+            attempts = subscription.attempts + 1
+            logging.warning(
+                "WebSubHub._deliver %s -> attempt %s failed with %s",
+                subscription.callback,
+                attempts,
+                e,
+            )
+            if attempts >= WEBSUB_MAX_ATTEMPTS:
+                await delivered.update(pending=False, attempts=attempts)
+            else:
+                retry_delay = WEBSUB_RETRY_DELAY_SECONDS * 2 ** (attempts - 1)
+                await delivered.update(
+                    attempts=attempts,
+                    next_attempt=datetime.now(timezone.utc)
+                    + timedelta(seconds=retry_delay),
+                )
+        finally:
+            self._in_flight.discard(subscription.id)
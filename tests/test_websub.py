@@ -0,0 +1,202 @@
+import asyncio
+import hashlib
+import hmac
+import os
+import socket
+import tempfile
+import threading
+import unittest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from unittest import mock
+from urllib.parse import parse_qs, urlparse
+
+# telegram_to_rss.config reads these on import
+os.environ.setdefault("TG_API_ID", "1")
+os.environ.setdefault("TG_API_HASH", "test")
+os.environ.setdefault("DATA_DIR", tempfile.mkdtemp())
+
+from telegram_to_rss.db import close_feeds_db, init_feeds_db  # noqa: E402
+from telegram_to_rss.models import WebSubSubscription  # noqa: E402
+from telegram_to_rss import websub  # noqa: E402
+from telegram_to_rss.websub import WebSubHub  # noqa: E402
+
+BASE_URL = "http://hub.test"
+FEED_ID = -1001234567890
+TOPIC = "{}/static/{}.xml".format(BASE_URL, FEED_ID)
+
+
+class StandInSubscriber:
+    """A local WebSub subscriber that confirms every intent and records the
+    content distributions it receives."""
+
+    def __init__(self) -> None:
+        self.verifications: list[dict[str, list[str]]] = []
+        self.deliveries: list[tuple[dict[str, str], bytes]] = []
+        self.delivery_status = 204
+        self.delivered = threading.Event()
+
+        subscriber = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, format, *args):
+                pass
+
+            def do_GET(self):
+                query = parse_qs(urlparse(self.path).query)
+                subscriber.verifications.append(query)
+                self.send_response(200)
+                self.end_headers()
+                self.wfile.write(query["hub.challenge"][0].encode())
+
+            def do_POST(self):
+                body = self.rfile.read(int(self.headers["Content-Length"]))
+                subscriber.deliveries.append((dict(self.headers), body))
+                self.send_response(subscriber.delivery_status)
+                self.end_headers()
+                subscriber.delivered.set()
+
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.callback = "http://127.0.0.1:{}/callback".format(self._server.server_port)
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+
+    def close(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+
+class WebSubHubTest(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        await init_feeds_db(":memory:")
+        self.static_path = Path(tempfile.mkdtemp())
+        self.static_path.joinpath("{}.xml".format(FEED_ID)).write_bytes(b"<rss />")
+        self.subscriber = StandInSubscriber()
+        self.hub = WebSubHub(
+            base_url=BASE_URL,
+            static_path=self.static_path,
+            worker_count=2,
+            allow_private_callbacks=True,
+        )
+
+    async def asyncTearDown(self):
+        await self.hub.stop()
+        self.subscriber.close()
+        await close_feeds_db()
+
+    async def subscribe(self, secret=None):
+        await self.hub.verify(
+            mode="subscribe",
+            feed_id=FEED_ID,
+            topic=TOPIC,
+            callback=self.subscriber.callback,
+            secret=secret,
+            lease_seconds=3600,
+        )
+
+    async def wait_for_delivery(self):
+        is_delivered = await asyncio.to_thread(self.subscriber.delivered.wait, 5)
+        self.assertTrue(is_delivered)
+        self.subscriber.delivered.clear()
+        # Let the worker record the outcome
+        await asyncio.sleep(0.1)
+
+    def test_topic_url(self):
+        self.assertEqual(self.hub.parse_topic_url(TOPIC), FEED_ID)
+        self.assertIsNone(self.hub.parse_topic_url("http://other.test/static/1.xml"))
+
+    async def test_private_callbacks_are_refused_by_default(self):
+        hub = WebSubHub(base_url=BASE_URL, static_path=self.static_path, worker_count=1)
+        self.assertFalse(await hub.is_callback_allowed(self.subscriber.callback))
+        self.assertFalse(await hub.is_callback_allowed("http://169.254.169.254/"))
+        self.assertFalse(await hub.is_callback_allowed("ftp://example.com/"))
+        self.assertTrue(await self.hub.is_callback_allowed(self.subscriber.callback))
+
+    async def test_requests_connect_to_the_checked_address(self):
+        # A rebinding name answers with a public address for the check and
+        # a private one for any later lookup
+        answers = iter(["93.184.215.14", "127.0.0.1"])
+
+        def getaddrinfo(host, port, *args, **kwargs):
+            return [(socket.AF_INET, socket.SOCK_STREAM, 6, "", (next(answers), 0))]
+
+        connected_to = []
+
+        def create_connection(address, *args, **kwargs):
+            connected_to.append(address)
+            raise ConnectionRefusedError()
+
+        with mock.patch.object(
+            websub.socket, "getaddrinfo", getaddrinfo
+        ), mock.patch.object(websub.socket, "create_connection", create_connection):
+            with self.assertRaises(ConnectionRefusedError):
+                await websub.http_request("POST", "http://rebind.test:8080/callback")
+
+        self.assertEqual(connected_to, [("93.184.215.14", 8080)])
+
+    async def test_subscribe_and_unsubscribe(self):
+        await self.subscribe()
+
+        [query] = self.subscriber.verifications
+        self.assertEqual(query["hub.mode"], ["subscribe"])
+        self.assertEqual(query["hub.topic"], [TOPIC])
+        self.assertEqual(query["hub.lease_seconds"], ["3600"])
+        self.assertEqual(await WebSubSubscription.filter(feed_id=FEED_ID).count(), 1)
+
+        await self.hub.verify(
+            mode="unsubscribe",
+            feed_id=FEED_ID,
+            topic=TOPIC,
+            callback=self.subscriber.callback,
+            secret=None,
+            lease_seconds=3600,
+        )
+        self.assertEqual(await WebSubSubscription.filter(feed_id=FEED_ID).count(), 0)
+
+    async def test_publish_delivers_signed_content_once(self):
+        await self.subscribe(secret="s3cr3t")
+        self.hub.start()
+
+        await self.hub.publish(FEED_ID, "digest-1")
+        await self.wait_for_delivery()
+
+        [(headers, body)] = self.subscriber.deliveries
+        self.assertEqual(body, b"<rss />")
+        self.assertEqual(headers["Content-Type"], "application/rss+xml")
+        self.assertIn('rel="hub"', headers["Link"])
+        expected_signature = hmac.new(b"s3cr3t", body, hashlib.sha256).hexdigest()
+        self.assertEqual(headers["X-Hub-Signature"], "sha256=" + expected_signature)
+
+        subscription = await WebSubSubscription.get(feed_id=FEED_ID)
+        self.assertFalse(subscription.pending)
+        self.assertEqual(subscription.published_digest, "digest-1")
+
+        # Same items, e.g. after a restart: nothing to distribute
+        await self.hub.publish(FEED_ID, "digest-1")
+        subscription = await WebSubSubscription.get(feed_id=FEED_ID)
+        self.assertFalse(subscription.pending)
+
+    async def test_failed_delivery_is_retried_later(self):
+        await self.subscribe()
+        self.subscriber.delivery_status = 500
+        self.hub.start()
+
+        await self.hub.publish(FEED_ID, "digest-1")
+        await self.wait_for_delivery()
+
+        subscription = await WebSubSubscription.get(feed_id=FEED_ID)
+        self.assertTrue(subscription.pending)
+        self.assertEqual(subscription.attempts, 1)
+
+    async def test_gone_subscriber_is_removed(self):
+        await self.subscribe()
+        self.subscriber.delivery_status = 410
+        self.hub.start()
+
+        await self.hub.publish(FEED_ID, "digest-1")
+        await self.wait_for_delivery()
+
+        self.assertEqual(await WebSubSubscription.filter(feed_id=FEED_ID).count(), 0)
+
+
+if __name__ == "__main__":
+    unittest.main()